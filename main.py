@@ -1,14 +1,17 @@
 import json
 import multiprocessing
 from pathlib import Path
+from shutil import which
 
 import PySimpleGUI as sg
 
-from utils import convert, set_ffmpeg_params, JCException
+from utils import convert, set_ffmpeg_params, split_params, JCException, ffmpeg
 
 HEADINGS = {'name': 'Название', 'files': 'Файл(ы)', 'stream_type': 'Тип дорожки',
             'number': 'Номер дорожки', 'language': 'Язык',
             'additional_params': 'Дополнительные аргументы'}
+SAVED_PARAMETERS = frozenset(('ffmpeg_params', 'output'))
+MOVE_EVENTS = frozenset(('up_track', 'down_track'))
 OUT_TOOLTIP = '''\
 {i} - номер файла
 {i+1} - номер файла + 1
@@ -16,6 +19,10 @@ OUT_TOOLTIP = '''\
 {i_max+1} - количество файлов +1
 {stem} - имя входного файла первой дорожки\
 '''
+PARALLEL_TOOLTIP = '''\
+Конвертировать несколько файлов одновременно (до половины ядер процессора).
+Если маска даёт одинаковые имена выходных файлов, они конвертируются по очереди.\
+'''
 FILE_TYPES = (('MP4', '*.mp4'),
               ('MKV', '*.mkv'),
               ('WEBP', '*.webp'),
@@ -37,7 +44,8 @@ main_layout = [
     [sg.Table(tracks, list(HEADINGS.values()), key='tracks', expand_x=True, enable_events=True)],
     [sg.Checkbox('Заменить файл', key='replace'),
      sg.Checkbox('Копировать кодек', key='codec_copy', default=True),
-     sg.Checkbox('Скрыть вывод в консоль', key='hide_logs')],
+     sg.Checkbox('Скрыть вывод в консоль', key='hide_logs'),
+     sg.Checkbox('Параллельная конвертация', key='parallel', tooltip=PARALLEL_TOOLTIP)],
     [sg.Text('Параметры ffmpeg'), sg.InputText(key='ffmpeg_params', expand_x=True)],
     [sg.Text('Выходной файл или маска', tooltip=OUT_TOOLTIP),
      sg.InputText(key='output', expand_x=True), sg.FileSaveAs(file_types=FILE_TYPES)],
@@ -62,15 +70,16 @@ def convert_window(*args, **kwargs):
         [sg.Button('Прервать', key='stop')]
     ]
     window = sg.Window('JustConverter | Конвертация', convert_layout)
-    proc = multiprocessing.Process(target=convert, args=args, kwargs=kwargs)
+    stop = multiprocessing.Event()
+    proc = multiprocessing.Process(target=convert, args=args, kwargs={**kwargs, 'stop': stop})
     proc.start()
     while True:
         event, values = window.read(1000)
         if not event:
             break
         elif event == 'stop':
-            proc.terminate()
-            break
+            stop.set()
+            window['stop'].update(disabled=True)
         elif event == '__TIMEOUT__':
             if not proc.is_alive():
                 break
@@ -87,12 +96,12 @@ def main_window():
         if not event:
             break
         elif event == 'load_parameters':
-            if not parameters_path.exists():
-                error_window('Параметры не сохранены!')
-                continue
             try:
                 with open(parameters_path) as f:
                     parameters = json.load(f)
+            except FileNotFoundError:
+                error_window('Параметры не сохранены!')
+                continue
             except json.JSONDecodeError as e:
                 error_window(e)
                 continue
@@ -108,21 +117,23 @@ def main_window():
             tracks.append(data)
             window['tracks'].update(tracks)
         elif event == 'delete_track':
-            for i in values['tracks']:
+            for i in sorted(values['tracks'], reverse=True):
                 tracks.pop(i)
             window['tracks'].update(tracks)
         elif event == 'update_track':
             if not values['tracks']:
                 error_window('Не выбрана ни одна дорожка!')
                 continue
+            track = tracks[values['tracks'][0]]
             for i, k in enumerate(HEADINGS.keys()):
                 if updating_track:
-                    tracks[values['tracks'][0]][i] = values[k]
-                    window['tracks'].update(tracks)
+                    track[i] = values[k]
                 else:
-                    window[k].update(tracks[values['tracks'][0]][i])
+                    window[k].update(track[i])
+            if updating_track:
+                window['tracks'].update(tracks)
             updating_track = False if updating_track else True
-        elif event in {'up_track', 'down_track'}:
+        elif event in MOVE_EVENTS:
             i = values['tracks'][0]
             to = -1 if event == 'up_track' else 1
             tracks.insert(i + to, tracks.pop(i))
@@ -131,21 +142,33 @@ def main_window():
             if not tracks:
                 error_window('Нет ни одной дорожки!')
                 continue
+            if not values['output']:
+                error_window('Не указан выходной файл!')
+                continue
+            if not which(ffmpeg[0]):
+                error_window('ffmpeg не найден в PATH!')
+                continue
+            ffmpeg_params = set_ffmpeg_params(values)
+            try:
+                for params in (ffmpeg_params, *(track[-1] for track in tracks)):
+                    split_params(params)
+            except ValueError as e:
+                error_window(f'Не удалось разобрать аргументы:\n{params}\n{e}')
+                continue
             try:
                 with open(parameters_path, 'w') as f:
-                    parameters = {k: values[k] for k in
-                                  {'ffmpeg_params', 'output'}}
+                    parameters = {k: values[k] for k in SAVED_PARAMETERS}
                     parameters['tracks'] = tracks
                     json.dump(parameters, f)
             except JCException as e:
                 error_window(e)
                 continue
 
-            values['ffmpeg_params'] = set_ffmpeg_params(values)
             convert_window(
                 tracks, HEADINGS,
-                str(values['ffmpeg_params']),
-                str(values['output']))
+                ffmpeg_params,
+                str(values['output']),
+                values['parallel'])
     window.close()
 
 
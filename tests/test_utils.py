@@ -0,0 +1,108 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import utils
+from utils import split_params
+
+
+@pytest.mark.parametrize('params, expected', [
+    (r'-vf subtitles=C:\subs\movie.srt', ['-vf', r'subtitles=C:\subs\movie.srt']),
+    (r'-i C:\logo.png', ['-i', r'C:\logo.png']),
+    (r'-i "C:\Program Files\logo.png"', ['-i', r'C:\Program Files\logo.png']),
+    (r'-metadata comment=Don\'t', ['-metadata', r"comment=Don\'t"]),
+    (r'-metadata "comment=say \"hi\""', ['-metadata', 'comment=say "hi"']),
+    (r'-i "C:\dir\\"', ['-i', 'C:\\dir\\']),
+    ('  -c   copy  ', ['-c', 'copy']),
+    ('-metadata title=""', ['-metadata', 'title=']),
+    ('', []),
+])
+def test_split_params_windows(params, expected):
+    assert split_params(params, posix=False) == expected
+
+
+def test_split_params_posix():
+    assert split_params("-metadata 'comment=a b' -c copy", posix=True) == ['-metadata', 'comment=a b', '-c', 'copy']
+    with pytest.raises(ValueError):
+        split_params("-metadata comment=Don't", posix=True)
+
+
+def _tracks(files):
+    return [{'name': 'v', 'files': files, 'stream_type': 'v', 'number': '0',
+             'language': 'rus', 'additional_params': ''}]
+
+
+def _run_batch(monkeypatch, output, parallel=True):
+    lock = threading.Lock()
+    running = peak = 0
+    params = set()
+
+    def fake_convert_file(tracks, ffmpeg_params, output, stop):
+        nonlocal running, peak
+        params.add(ffmpeg_params)
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+
+    monkeypatch.setattr(utils, 'convert_file', fake_convert_file)
+    monkeypatch.setattr(utils, 'cpu_count', lambda: 8)
+    utils.convert_files(_tracks(['a.mkv', 'b.mkv', 'c.mkv']), '-c copy', output, parallel, threading.Event())
+    return peak, params
+
+
+def test_convert_files_parallel_with_unique_outputs(monkeypatch):
+    assert _run_batch(monkeypatch, 'out/{stem}.mkv') == (3, {f'-threads {utils.FFMPEG_THREADS} -c copy'})
+
+
+def test_convert_files_sequential_with_same_output(monkeypatch):
+    assert _run_batch(monkeypatch, 'out/result.mkv') == (1, {'-c copy'})
+
+
+def test_convert_files_sequential_by_default(monkeypatch):
+    assert _run_batch(monkeypatch, 'out/{stem}.mkv', parallel=False) == (1, {'-c copy'})
+
+
+def test_convert_file_stop_ends_ffmpeg(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, 'ffmpeg', [sys.executable, '-c', 'import time; time.sleep(60)'])
+    stop = threading.Event()
+    threading.Timer(0.5, stop.set).start()
+    start = time.monotonic()
+    utils.convert_file([{**_tracks(['a.mkv'])[0], 'file': 'a.mkv'}], '-c copy', tmp_path / 'out.mkv', stop)
+    assert time.monotonic() - start < 5
+
+
+def test_convert_files_cancels_queued_files_after_failure(monkeypatch):
+    started = []
+
+    def fake_convert_file(tracks, ffmpeg_params, output, stop):
+        started.append(tracks[0]['file'])
+        if tracks[0]['file'] == 'a.mkv':
+            raise OSError('ffmpeg failed')
+        time.sleep(0.2)
+
+    monkeypatch.setattr(utils, 'convert_file', fake_convert_file)
+    with pytest.raises(OSError):
+        utils.convert_files(_tracks(['a.mkv', 'b.mkv', 'c.mkv']), '-c copy', 'out/{stem}.mkv', False,
+                            threading.Event())
+    assert 'c.mkv' not in started
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='SIGTERM handlers are POSIX-only')
+def test_convert_file_stop_lets_ffmpeg_finish(monkeypatch, tmp_path):
+    marker = tmp_path / 'finished'
+    script = ('import signal, sys, time\n'
+              'def finish(*args):\n'
+              f'    open({str(marker)!r}, "w").close()\n'
+              '    sys.exit(255)\n'
+              'signal.signal(signal.SIGTERM, finish)\n'
+              'time.sleep(60)\n')
+    monkeypatch.setattr(utils, 'ffmpeg', [sys.executable, '-c', script])
+    stop = threading.Event()
+    threading.Timer(0.5, stop.set).start()
+    utils.convert_file([{**_tracks(['a.mkv'])[0], 'file': 'a.mkv'}], '-c copy', tmp_path / 'out.mkv', stop)
+    assert marker.exists()
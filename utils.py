@@ -1,14 +1,27 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from os import system
+from os import cpu_count, name as os_name
+from os.path import abspath, normcase
 from pathlib import Path
+from shlex import split
+from subprocess import DEVNULL, Popen, TimeoutExpired
+from typing import Protocol
 
-ffmpeg = 'ffmpeg -hwaccel cuda'
+ffmpeg = ['ffmpeg', '-hwaccel', 'cuda']
+FFMPEG_THREADS = 2
+TERMINATE_TIMEOUT = 10
 
 
 class JCException(Exception):
     pass
 
 
+class StopEvent(Protocol):
+    def is_set(self) -> bool: ...
+
+
 def set_ffmpeg_params(values):
     ffmpeg_params = values['ffmpeg_params'] if values['ffmpeg_params'] and not values['codec_copy'] else '-c copy'
     ffmpeg_params += ' -y' if values['replace'] else ' -n'
@@ -20,6 +33,45 @@ def q(s):
     return f'"{s}"' if ' ' in str(s) else str(s)
 
 
+def split_params(params: str, posix: bool = os_name != 'nt') -> list[str]:
+    # На Windows обратная косая черта экранирует только кавычку (как при разборе
+    # командной строки ffmpeg.exe), поэтому пути вида C:\dir\file не меняются.
+    if posix:
+        return split(params)
+    args = []
+    arg = []
+    in_arg = quoted = False
+    backslashes = 0
+    for c in params:
+        if c == '\\':
+            backslashes += 1
+            in_arg = True
+            continue
+        if c == '"':
+            arg.append('\\' * (backslashes // 2))
+            if backslashes % 2:
+                arg.append(c)
+            else:
+                quoted = not quoted
+            backslashes = 0
+            in_arg = True
+            continue
+        arg.append('\\' * backslashes)
+        backslashes = 0
+        if c in ' \t' and not quoted:
+            if in_arg:
+                args.append(''.join(arg))
+                arg = []
+                in_arg = False
+        else:
+            arg.append(c)
+            in_arg = True
+    arg.append('\\' * backslashes)
+    if in_arg:
+        args.append(''.join(arg))
+    return args
+
+
 def get_paths(path, pattern=None):
     path = Path(path)
     try:
@@ -33,32 +85,43 @@ def get_paths(path, pattern=None):
                           f'{e}')
 
 
-def convert_file(tracks: list[dict], ffmpeg_params: str, output: Path):
+def convert_file(tracks: list[dict], ffmpeg_params: str, output: Path, stop: StopEvent):
+    if stop.is_set():
+        return
     inputs = []
     maps = []
-    metadata = ['-map_metadata -1']
+    metadata = ['-map_metadata', '-1']
 
     for i, track in enumerate(tracks):
         if track['additional_params']:
-            inputs.append(track['additional_params'])
-        inputs.append(f"-i {q(track['file'])}")
-        maps.append(f"-map {i}:{track['stream_type']}:{track['number']}")
-        metadata.append(f'-metadata:s:{i} title="{track["name"]}"')
-        metadata.append(f'-metadata:s:{i} language={track["language"][:3]}')
-    cmd = ' '.join([ffmpeg, *inputs, *maps, *metadata, ffmpeg_params, q(output)])
-    print(cmd)
-    system(cmd)
-
-
-def convert_files(tracks: list[dict], ffmpeg_params: str, output: str):
-    for file_i in range(len(tracks[0]['files'])):
-        file_tracks = dict()
-        for track in tracks:
-            track['file'] = track['files'][file_i]
-            file_tracks = track
-
-        file_path = Path(file_tracks['file'])
-        files_count = len(file_tracks['files'])
+            inputs.extend(split_params(track['additional_params']))
+        inputs.extend(('-i', track['file']))
+        maps.extend(('-map', f"{i}:{track['stream_type']}:{track['number']}"))
+        metadata.extend((f'-metadata:s:{i}', f'title={track["name"]}'))
+        metadata.extend((f'-metadata:s:{i}', f'language={track["language"][:3]}'))
+    cmd = [*ffmpeg, *inputs, *maps, *metadata, *split_params(ffmpeg_params), str(output)]
+    print(' '.join(map(q, cmd)))
+    with Popen(cmd, stdin=DEVNULL) as proc:
+        while True:
+            try:
+                proc.wait(1)
+                break
+            except TimeoutExpired:
+                if stop.is_set():
+                    proc.terminate()
+                    try:
+                        proc.wait(TERMINATE_TIMEOUT)
+                    except TimeoutExpired:
+                        proc.kill()
+
+
+def convert_files(tracks: list[dict], ffmpeg_params: str, output: str, parallel: bool, stop: StopEvent):
+    files_count = len(tracks[0]['files'])
+    jobs = []
+    for file_i in range(files_count):
+        file_tracks = [{**track, 'file': track['files'][file_i]} for track in tracks]
+
+        file_path = Path(file_tracks[0]['file'])
         file_output = Path(output.format_map({
             'i': file_i,
             'i+1': file_i + 1,
@@ -66,13 +129,28 @@ def convert_files(tracks: list[dict], ffmpeg_params: str, output: str):
             'max_i+1': files_count + 1,
             'stem': file_path.stem
         }))
-        convert_file(tracks, ffmpeg_params, file_output)
-
-
-def convert(tracks: list[list], headings: dict, ffmpeg_params: str, output: str):
+        jobs.append((file_tracks, file_output))
+
+    workers = 1
+    if parallel and len({normcase(abspath(file_output)) for _, file_output in jobs}) == files_count:
+        workers = min(files_count, max(1, (cpu_count() or 1) // FFMPEG_THREADS))
+    if workers > 1:
+        ffmpeg_params = f'-threads {FFMPEG_THREADS} {ffmpeg_params}'
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convert_file, file_tracks, ffmpeg_params, file_output, stop)
+                   for file_tracks, file_output in jobs]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def convert(tracks: list[list], headings: dict, ffmpeg_params: str, output: str, parallel: bool, stop: StopEvent):
     tracks: list = deepcopy(tracks)
     for i, track in enumerate(tracks):
-        track = {k: track[j] for j, k in enumerate(headings.keys())}
+        track = dict(zip(headings, track))
         track['files'] = track['files'].split(';')
         tracks[i] = track
-    convert_files(tracks, ffmpeg_params, output)
+    convert_files(tracks, ffmpeg_params, output, parallel, stop)